@@ -5,51 +5,169 @@ import os
 import sys
 import subprocess
 import argparse
-import google.generativeai as genai
-from dotenv import load_dotenv
+import concurrent.futures
+import fnmatch
+import functools
+import hashlib
+import random
+import shutil
+import tempfile
+import threading
+import time
+import unicodedata
+from pathlib import Path
 import re # Import re for branch name sanitization
 
-# Load environment variables from .env file
-load_dotenv()
-
 # --- Configuration ---
-# Try to get Gemini API key from environment
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+# Gemini API key, set by load_api_key() once main() knows the API will be needed
+GEMINI_API_KEY = None
 # List of allowed Gemini models
 ALLOWED_MODELS = ["gemini-2.0-flash-lite", "gemini-2.0-flash", "gemini-1.5-flash", "gemini-1.5-pro"]
 # Default Gemini model to use
 DEFAULT_MODEL_NAME = "gemini-2.0-flash-lite"
-# Instruction for the AI to generate the commit message
-COMMIT_MESSAGE_PROMPT_TEMPLATE = """
+# Directory where generated commit messages are cached, keyed by model, language and diff
+CACHE_DIR = Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache") / "aicommit" # An empty XDG_CACHE_HOME means unset
+# Cached messages older than this (in seconds) are ignored
+CACHE_MAX_AGE = 7 * 24 * 60 * 60
+# Prefix for read-only Git commands (status/diff): skips the optional index lock
+# (refreshing the index), the fsmonitor hook and automatic gc
+GIT_READ_ONLY = ['git', '--no-optional-locks', '-c', 'core.fsmonitor=false', '-c', 'gc.auto=0']
+# Lists changes to tracked files only: untracked files never show up in 'git diff'
+GIT_STATUS_COMMAND = GIT_READ_ONLY + ['status', '--porcelain=v2', '-z', '--untracked-files=no']
+# Maximum diff size (in bytes) sent to the API
+DIFF_MAX_BYTES = 16000
+# Maximum raw 'git diff' output (in bytes) read from Git; shrink_diff() then trims it to DIFF_MAX_BYTES
+DIFF_READ_MAX_BYTES = 1024 * 1024
+# Files whose changes are only listed, not sent, since they are large and meaningless to the AI
+DIFF_IGNORED_FILES = ["*.lock", "package-lock.json", "yarn.lock", "*.min.js", "*.svg"]
+# Pathspecs matching DIFF_IGNORED_FILES at any depth (relative to the repository root)
+DIFF_IGNORED_PATHSPECS = [
+    f"{prefix}{pattern}"
+    for pattern in DIFF_IGNORED_FILES
+    for prefix in ([''] if pattern.startswith('*') else ['', '*/'])
+]
+# Pathspecs keeping DIFF_IGNORED_FILES out of 'git diff', and selecting only them (to list their names)
+DIFF_EXCLUDE_PATHSPECS = ['--', ':/'] + [f":(top,exclude){pathspec}" for pathspec in DIFF_IGNORED_PATHSPECS]
+DIFF_INCLUDE_PATHSPECS = ['--'] + [f":(top){pathspec}" for pathspec in DIFF_IGNORED_PATHSPECS]
+# Files with more diff lines than this are reduced to their first and last DIFF_FILE_KEEP_LINES lines
+DIFF_FILE_MAX_LINES = 400
+DIFF_FILE_KEEP_LINES = 40
+# Removed from generated commit messages and branch names in one pass: code fences (with their language tag) and quotes
+RESPONSE_CLEANUP_RE = re.compile(r'```[a-zA-Z]*\n|[`"\']')
+# Runs of spaces/underscores (group 1, replaced by a hyphen) or any other character not allowed in branch names
+BRANCH_NAME_INVALID_RE = re.compile(r'([\s_]+)|[^a-zA-Z0-9\-/]')
+# Conventional Commits title: type, optional scope, optional '!' and summary
+CONVENTIONAL_COMMIT_RE = re.compile(r'^(?P<type>feat|fix|chore|docs|refactor|test|style|perf|build|ci|revert)(\([^)]*\))?!?:\s*(?P<summary>.+)$', re.IGNORECASE)
+# Branch names derived from the commit message are cut to this length
+BRANCH_NAME_MAX_LENGTH = 50
+# Languages supported for the commit message
+LANGUAGE_NAMES = {'pt': 'Portuguese', 'en': 'English'}
+# Safety settings sent with every request (diffs can contain anything, nothing should be blocked)
+SAFETY_SETTINGS = [
+    {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"},
+]
+# Generation settings for the commit message: only the first line is used, so keep the output short
+COMMIT_MESSAGE_GENERATION_CONFIG = {'max_output_tokens': 80, 'temperature': 0.2}
+# Maximum number of repositories processed concurrently in --batch mode (bounded by the API rate limit)
+BATCH_MAX_WORKERS = 4
+# Retries for rate limited (429) or temporarily unavailable API calls, with exponential backoff
+API_MAX_ATTEMPTS = 3
+API_RETRY_BASE_DELAY = 1.0 # Seconds, doubled on each attempt (+/- 25% jitter)
+# Instruction for the AI to generate the commit message, split around the diff so the
+# (possibly large) diff is sent as a separate prompt part instead of being copied into the text
+COMMIT_MESSAGE_PROMPT_HEAD = """
 Generate a concise and meaningful commit message in {language}, following the Conventional Commits standard (e.g., 'feat: add new feature X', 'fix: correct bug Y', 'docs: update documentation Z', 'style: format code', 'refactor: refactor component A', 'test: add tests for B', 'chore: update dependencies').
 
 The message must have a maximum of 72 characters in the first line (title) and clearly describe the changes present in the following 'git diff':
 
-{diff}
+"""
+COMMIT_MESSAGE_PROMPT_TAIL = """
 
 Generated commit message:
 """
-# Instruction for the AI to generate the branch name
-BRANCH_NAME_PROMPT_TEMPLATE = """
+# Prompt head already formatted for each supported language
+COMMIT_MESSAGE_PROMPT_HEADS = {lang: COMMIT_MESSAGE_PROMPT_HEAD.format(language=name) for lang, name in LANGUAGE_NAMES.items()}
+# Instruction for the AI to generate the branch name, split around the diff in the same way
+BRANCH_NAME_PROMPT_HEAD = """
 Generate a short, descriptive Git branch name based on the following 'git diff'.
 The branch name should be suitable for use in a URL (kebab-case: lowercase, words separated by hyphens, no special characters other than hyphens).
 Optionally, prefix the name with 'feat/', 'fix/', 'chore/', 'docs/', 'refactor/', etc., based on the primary nature of the changes.
 Keep the total length concise, ideally under 50 characters.
 
 Git Diff:
-{diff}
+"""
+BRANCH_NAME_PROMPT_TAIL = """
 
 Generated branch name:
 """
+# Instruction for the AI to generate both in a single request (--single-request), sending the diff only once
+BRANCH_AND_COMMIT_PROMPT_HEAD = """
+Based on the following 'git diff', generate:
+1. A short, descriptive Git branch name in kebab-case (lowercase, words separated by hyphens), optionally prefixed with 'feat/', 'fix/', 'chore/', 'docs/', 'refactor/', etc., ideally under 50 characters.
+2. A concise and meaningful commit message in {language}, following the Conventional Commits standard (e.g., 'feat: add new feature X', 'fix: correct bug Y'), with a maximum of 72 characters.
+
+Answer with exactly two lines and nothing else:
+Branch: <branch name>
+Commit: <commit message>
+
+Git Diff:
+"""
+BRANCH_AND_COMMIT_PROMPT_TAIL = """
+
+Answer:
+"""
+# Extracts the two answers from the single-request reply
+BRANCH_AND_COMMIT_REPLY_RE = re.compile(r'^\W*branch\W*:[\s*_]*(?P<branch>.+?)\s*\n(?:.*\n)*?\W*commit\W*:[\s*_]*(?P<commit>.+?)\s*$', re.IGNORECASE | re.MULTILINE)
+
+# Appended to the prompt when the user asks to regenerate, so the request (and its answer) differs
+REGENERATION_PROMPT_NOTE = "\n\n(Regeneration #{count}: suggest a different alternative than the previous ones.)"
+
+# Serializes model construction between the prefetch thread and the main thread
+_model_lock = threading.Lock()
 
 # --- Helper Functions ---
 #
 
-def run_git_command(command, verbose=False):
-    """Executes a Git command and returns the output or raises an exception on error."""
+def load_api_key():
+    """Gets the Gemini API key from the environment, falling back to the .env file only when it is not set."""
+    global GEMINI_API_KEY
+    GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
+    if GEMINI_API_KEY is None:
+        # Imported lazily, like the Gemini SDK, to keep --help and the early exits fast
+        from dotenv import load_dotenv
+        load_dotenv()
+        GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
+    return GEMINI_API_KEY
+
+def run_git_command(command, verbose=False, strip=True, binary=False, cwd=None, max_bytes=None):
+    """Executes a Git command and returns the output (undecoded bytes if binary=True, stripped unless strip=False, cut at max_bytes) or raises an exception on error."""
     try:
-        result = subprocess.run(command, text=True, capture_output=True, check=True, encoding='utf-8')
-        return result.stdout.strip()
+        # Only stdout is piped; stderr goes to a temporary file that is read only if the command fails
+        # Output is read as raw bytes and decoded once at the end (no text wrapper on the pipe)
+        truncated = False
+        with tempfile.TemporaryFile() as stderr_file:
+            with subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr_file, cwd=cwd) as process:
+                if max_bytes is None:
+                    stdout = process.stdout.read()
+                else:
+                    # Never hold more than max_bytes + 1 bytes: stop Git as soon as the output is known to be longer
+                    stdout = process.stdout.read(max_bytes + 1)
+                    truncated = len(stdout) > max_bytes
+                    if truncated:
+                        process.kill()
+                        stdout = stdout[:max_bytes] + b"\n...[output truncated at %d bytes]..." % max_bytes
+                        if verbose:
+                            print(f"✂️ Git output exceeded {max_bytes} bytes and was truncated.")
+            if process.returncode != 0 and not truncated:
+                stderr_file.seek(0)
+                stderr = stderr_file.read().decode('utf-8', 'replace')
+                raise subprocess.CalledProcessError(process.returncode, command, stdout, stderr)
+        if not binary:
+            stdout = stdout.decode('utf-8', 'replace')
+        return stdout.strip() if strip else stdout
     except FileNotFoundError:
         print(f"Error: Command '{command[0]}' not found. Is Git installed and in PATH?")
         sys.exit(1)
@@ -67,63 +185,285 @@ def run_git_command(command, verbose=False):
         print(f"An unexpected error occurred while running Git: {e}")
         sys.exit(1)
 
-def get_staged_diff(verbose=False):
-    """Gets the 'staged' changes (added to the stage) in the repository."""
+def parse_change_state(status):
+    """Parses 'git status --porcelain=v2 -z' output into (has_staged, has_unstaged)."""
+    has_staged = has_unstaged = False
+    entries = iter(status.split('\0'))
+    for entry in entries:
+        if entry.startswith(('1 ', '2 ')):
+            # 'XY' field: X is the staged status, Y the unstaged one, '.' meaning unchanged
+            has_staged = has_staged or entry[2] != '.'
+            has_unstaged = has_unstaged or entry[3] != '.'
+            if entry.startswith('2 '):
+                next(entries, None) # Renames/copies are followed by the original path
+        elif entry.startswith('u '):
+            has_staged = has_unstaged = True # Unmerged paths show up in both diffs
+    return has_staged, has_unstaged
+
+def get_change_state(verbose=False, cwd=None):
+    """Checks with a single 'git status' whether there are staged and/or unstaged changes, without reading any diff."""
     if verbose:
-        print("🔍 Checking staged changes (git diff --staged)...")
-    diff = run_git_command(['git', 'diff', '--staged'], verbose=verbose)
-    if diff and verbose:
+        print("🔍 Checking staged and unstaged changes (git status --porcelain=v2)...")
+    has_staged, has_unstaged = parse_change_state(run_git_command(GIT_STATUS_COMMAND, verbose=verbose, cwd=cwd))
+    if has_staged and verbose:
         print(" Staged changes detected.")
-    return diff
-
-def get_unstaged_diff(verbose=False):
-    """Gets the 'unstaged' changes (not added to the stage) in the repository."""
-    if verbose:
-        print("🔍 Checking unstaged changes (git diff)...")
-    diff = run_git_command(['git', 'diff'], verbose=verbose)
-    if diff and verbose:
+    if has_unstaged and verbose:
         print(" Unstaged changes detected.")
-    return diff
+    return has_staged, has_unstaged
+
+def probe_change_state():
+    """Like get_change_state, but silent and returning None on any error instead of exiting."""
+    try:
+        result = subprocess.run(GIT_STATUS_COMMAND, capture_output=True)
+    except FileNotFoundError:
+        return None
+    if result.returncode != 0:
+        return None
+    return parse_change_state(result.stdout.decode('utf-8', 'replace'))
+
+def read_diff(command, verbose=False, cwd=None):
+    """Runs a 'git diff' command without DIFF_IGNORED_FILES, or with them if nothing else changed, and returns bytes."""
+    # Streamed with a cap, so a huge diff is never fully loaded only to be trimmed by shrink_diff()
+    diff = run_git_command(command + DIFF_EXCLUDE_PATHSPECS, verbose=verbose, strip=False, binary=True, cwd=cwd, max_bytes=DIFF_READ_MAX_BYTES)
+    if not diff:
+        # Only ignored files changed: read them anyway, shrink_diff() still lists them for the AI
+        return run_git_command(command, verbose=verbose, strip=False, binary=True, cwd=cwd, max_bytes=DIFF_READ_MAX_BYTES)
+    # The ignored files are listed by name only (shrink_diff() turns each header into '[changes omitted]'),
+    # so the AI still knows that e.g. the dependencies changed
+    ignored = run_git_command(command + ['--name-only', '-z'] + DIFF_INCLUDE_PATHSPECS, verbose=verbose, strip=False, binary=True, cwd=cwd)
+    headers = [b"diff --git a/%s b/%s\n" % (path, path) for path in ignored.split(b'\0') if path]
+    return diff + b''.join(headers)
+
+def get_staged_diff(verbose=False, cwd=None):
+    """Gets the 'staged' changes (added to the stage) in the repository, as bytes."""
+    return read_diff(GIT_READ_ONLY + ['diff', '--staged'], verbose=verbose, cwd=cwd)
+
+def get_unstaged_diff(verbose=False, cwd=None):
+    """Gets the 'unstaged' changes (not added to the stage) in the repository, as bytes."""
+    return read_diff(GIT_READ_ONLY + ['diff'], verbose=verbose, cwd=cwd)
+
+def get_diff(verbose=False, cwd=None, change_state=None):
+    """Returns (diff, is_staged) for the staged changes if any, else the unstaged ones, or (None, False) if there are none."""
+    # The diff is trimmed here, once for all the API calls that use it
+    # A single 'git status' (skipped if change_state is given) decides which one diff is read
+    has_staged, has_unstaged = change_state or get_change_state(verbose=verbose, cwd=cwd)
+    if has_staged:
+        if verbose:
+            print("ℹ️ Using staged changes for AI generation.")
+        return shrink_diff(get_staged_diff(verbose=verbose, cwd=cwd)), True
+    if has_unstaged:
+        if verbose:
+            print("ℹ️ No staged changes found. Using unstaged changes for AI generation.")
+        return shrink_diff(get_unstaged_diff(verbose=verbose, cwd=cwd)), False
+    return None, False
 
 def sanitize_branch_name(name):
     """Sanitizes a string to be a valid Git branch name."""
     # Remove potential prefixes like ``` or `
     name = name.strip('` ')
-    # Replace spaces and underscores with hyphens
-    name = re.sub(r'[\s_]+', '-', name)
-    # Remove any characters that are not alphanumeric, hyphen, or forward slash
-    name = re.sub(r'[^a-zA-Z0-9\-/]', '', name)
+    # Keep accented letters as their base letter (e.g. 'validação' -> 'validacao') instead of dropping them
+    name = ''.join(char for char in unicodedata.normalize('NFKD', name) if not unicodedata.combining(char))
+    # Replace spaces and underscores with hyphens and remove any other character
+    # that is not alphanumeric, hyphen, or forward slash, in a single pass
+    name = BRANCH_NAME_INVALID_RE.sub(lambda match: '-' if match.group(1) else '', name)
     # Remove leading/trailing hyphens
     name = name.strip('-')
     # Ensure it's not empty
     if not name:
-        return f"ai-generated-branch-{os.urandom(4).hex()}" # Fallback name
+        return random_branch_name()
     return name.lower()
 
+def random_branch_name():
+    """Returns a fallback branch name, for when no valid one could be built."""
+    return f"ai-generated-branch-{os.urandom(4).hex()}"
+
+def is_valid_branch_name(name):
+    """Checks a branch name with 'git check-ref-format --branch'."""
+    return subprocess.run(['git', 'check-ref-format', '--branch', name],
+                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode == 0
+
+def branch_name_from_message(message, verbose=False):
+    """Derives a branch name from a Conventional Commits message (e.g. 'feat: add X' -> 'feat/add-x')."""
+    match = CONVENTIONAL_COMMIT_RE.match(message)
+    # The type is the only path component: a '/' in the summary (e.g. 'update docs/') becomes a word separator
+    summary = (match.group('summary') if match else message).replace('/', ' ').strip()
+    name = f"{match.group('type')}/{summary}" if match else summary
+    branch_name = sanitize_branch_name(name)
+    if len(branch_name) > BRANCH_NAME_MAX_LENGTH:
+        head = branch_name[:BRANCH_NAME_MAX_LENGTH + 1]
+        # Cut at a word boundary, or right at the limit if there is none
+        branch_name = (head.rsplit('-', 1)[0] if '-' in head else head[:BRANCH_NAME_MAX_LENGTH]).rstrip('-/')
+    if not is_valid_branch_name(branch_name):
+        branch_name = random_branch_name()
+    if verbose:
+        print(f"✨ Branch name derived from the commit message: '{branch_name}'")
+    return branch_name
+
+def shrink_diff(diff, max_bytes=DIFF_MAX_BYTES):
+    """Reduces a (bytes) diff to what the AI needs: drops lockfiles/binaries, shortens huge files and caps the size."""
+    sections = re.split(rb'^(?=diff --git )', diff, flags=re.MULTILINE)
+    shrunk = []
+    for section in sections:
+        if not section:
+            continue
+        lines = section.splitlines()
+        header = re.match(rb'diff --git a/(.*) b/(.*)', lines[0])
+        path = header.group(2) if header else b''
+        is_binary = any(line.startswith(b'Binary files ') and line.endswith(b' differ') for line in lines)
+        if is_binary or any(fnmatch.fnmatch(os.path.basename(path), pattern.encode()) for pattern in DIFF_IGNORED_FILES):
+            shrunk.append(lines[0] + b"\n[changes omitted]")
+        elif len(lines) > DIFF_FILE_MAX_LINES:
+            omitted = len(lines) - 2 * DIFF_FILE_KEEP_LINES
+            shrunk.append(b'\n'.join(lines[:DIFF_FILE_KEEP_LINES] + [b"...[%d lines omitted]..." % omitted] + lines[-DIFF_FILE_KEEP_LINES:]))
+        else:
+            shrunk.append(section.rstrip(b'\n'))
+    result = b'\n'.join(shrunk)
+    if len(result) > max_bytes:
+        result = result[:max_bytes] + b"\n...[truncated %d bytes]..." % (len(result) - max_bytes)
+    return result
+
+def first_message_line(lines):
+    """Returns the first non-empty line that is not a code fence, or None."""
+    for line in lines:
+        line = line.strip()
+        if line and not line.startswith('```'):
+            return line
+    return None
+
+def read_first_line(response):
+    """Reads a streamed response only until its first meaningful line is complete."""
+    text = ''
+    for chunk in response:
+        try:
+            text += chunk.text
+        except ValueError:
+            continue # Chunk without text parts (e.g. the final one)
+        line = first_message_line(text.split('\n')[:-1]) # Ignore the last, possibly incomplete, line
+        if line:
+            return line # Stop reading, the rest of the body is not used
+    return first_message_line(text.split('\n')) or ''
+
+def read_choice(prompt):
+    """Prompts for a single keypress (without Enter when stdin is a terminal) and returns it lowercased."""
+    print(prompt, end='', flush=True)
+    if not sys.stdin.isatty():
+        return input().lower().strip() # Piped input keeps its line-based behavior
+    if os.name == 'nt':
+        import msvcrt
+        while msvcrt.kbhit(): # Drop keys typed ahead, e.g. the Enter after a previous 'y'
+            msvcrt.getwch()
+        choice = msvcrt.getwch()
+    else:
+        import termios
+        import tty
+        fd = sys.stdin.fileno()
+        old_settings = termios.tcgetattr(fd)
+        try:
+            tty.setcbreak(fd) # Ctrl+C still raises KeyboardInterrupt in cbreak mode
+            termios.tcflush(fd, termios.TCIFLUSH) # Drop keys typed ahead, e.g. the Enter after a previous 'y'
+            # Read from the descriptor: sys.stdin would buffer (and later return) the keys typed after this one
+            choice = os.read(fd, 1).decode('utf-8', 'replace')
+        finally:
+            termios.tcsetattr(fd, termios.TCSADRAIN, old_settings)
+    print(choice.strip()) # Echo the key, since the terminal does not
+    return choice.lower().strip()
+
+@functools.lru_cache(maxsize=None)
+def configure_genai():
+    """Imports and configures the Gemini SDK once per process, and returns the module."""
+    # Imported lazily: the SDK is slow to import and not needed on the early exit paths
+    import google.generativeai as genai
+    genai.configure(api_key=GEMINI_API_KEY)
+    return genai
+
+@functools.lru_cache(maxsize=4)
+def build_model(model_name):
+    """Builds a GenerativeModel. Cached, use get_model()."""
+    return configure_genai().GenerativeModel(model_name)
+
+def get_model(model_name):
+    """Returns a configured GenerativeModel, building it only once per model name."""
+    # The lock keeps the prefetch thread and the main thread from building the same model twice
+    with _model_lock:
+        return build_model(model_name)
+
+def prefetch_model(model_name):
+    """Builds the model in a background thread so it overlaps with the git diff."""
+    def _build():
+        try:
+            get_model(model_name)
+        except Exception:
+            pass # Any error is reported again when the model is actually used
+    threading.Thread(target=_build, daemon=True).start()
+
+def call_with_backoff(request, verbose=False):
+    """Calls request(), retrying with exponential backoff when the API is rate limited or unavailable."""
+    from google.api_core import exceptions
+    retryable = (exceptions.ResourceExhausted, exceptions.ServiceUnavailable, exceptions.DeadlineExceeded)
+    for attempt in range(API_MAX_ATTEMPTS):
+        try:
+            return request()
+        except retryable as e:
+            if attempt == API_MAX_ATTEMPTS - 1:
+                raise
+            delay = getattr(e, 'retry_after', None) or API_RETRY_BASE_DELAY * 2 ** attempt * (1 + random.uniform(-0.25, 0.25))
+            if verbose:
+                print(f"⏳ Gemini API unavailable ({type(e).__name__}), retrying in {delay:.1f}s...")
+            time.sleep(delay)
+
+def get_request_prompt(prompt, regenerations=0):
+    """Returns the prompt parts to send, with the regeneration note if the user asked to regenerate."""
+    if regenerations:
+        return prompt + [REGENERATION_PROMPT_NOTE.format(count=regenerations)]
+    return prompt
+
+def get_cache_path(diff, model_name, lang):
+    """Returns the cache file path for a given diff, model and language."""
+    # Not security sensitive: blake2b is much faster than sha256 on large diffs
+    key = hashlib.blake2b(f"{model_name}\0{lang}\0".encode('utf-8'), digest_size=16)
+    key.update(diff) # Hashed separately to avoid copying the diff into a concatenated buffer
+    return CACHE_DIR / f"{key.hexdigest()}.txt"
+
+def read_cached_message(cache_path):
+    """Returns the cached commit message, or None if missing, expired or unreadable."""
+    try:
+        if time.time() - cache_path.stat().st_mtime > CACHE_MAX_AGE:
+            return None
+        return cache_path.read_text(encoding='utf-8').strip() or None
+    except OSError:
+        return None
+
+def write_cached_message(cache_path, message):
+    """Stores a commit message in the cache. Failures are silently ignored."""
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        cache_path.write_text(message, encoding='utf-8')
+    except OSError:
+        pass
+
+def remove_cached_message(cache_path):
+    """Removes a cached commit message, if any. Failures are silently ignored."""
+    try:
+        cache_path.unlink()
+    except OSError:
+        pass
+
 def generate_branch_name(diff, model_name=DEFAULT_MODEL_NAME, verbose=False, interactive=False):
     """Generates a branch name using the Gemini API, with optional interactive confirmation."""
-    if not GEMINI_API_KEY:
-        print("Error: Gemini API key (GEMINI_API_KEY) not found.")
-        print("Check your .env file or system environment variables.")
-        sys.exit(1)
+    # Built once, regenerating reuses the same prompt
+    prompt = [BRANCH_NAME_PROMPT_HEAD, diff.decode('utf-8', 'replace'), BRANCH_NAME_PROMPT_TAIL]
+    regenerations = 0
 
     while True: # Loop for regeneration
         if verbose:
             print(f"🤖 Generating branch name with model {model_name}...")
         try:
-            genai.configure(api_key=GEMINI_API_KEY)
-            model = genai.GenerativeModel(model_name)
-            prompt = BRANCH_NAME_PROMPT_TEMPLATE.format(diff=diff)
-
-            safety_settings = [
-                {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
-                {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
-                {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_NONE"},
-                {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"},
-            ]
-            response = model.generate_content(prompt, safety_settings=safety_settings)
-
-            branch_name = response.text.strip()
+            request_prompt = get_request_prompt(prompt, regenerations)
+            model = get_model(model_name)
+
+            response = call_with_backoff(lambda: model.generate_content(request_prompt, safety_settings=SAFETY_SETTINGS), verbose=verbose)
+
+            branch_name = RESPONSE_CLEANUP_RE.sub('', response.text).strip()
             sanitized_name = sanitize_branch_name(branch_name)
 
             if not sanitized_name:
@@ -141,7 +481,7 @@ def generate_branch_name(diff, model_name=DEFAULT_MODEL_NAME, verbose=False, int
             # --- Interactive Confirmation ---
             print(f"\nSuggested branch name: \033[1m{sanitized_name}\033[0m") # Bold text
             while True:
-                choice = input("Accept this branch name? (y/n/r=regenerate): ").lower().strip()
+                choice = read_choice("Accept this branch name? (y/n/r=regenerate): ")
                 if choice == 'y':
                     return sanitized_name
                 elif choice == 'n':
@@ -150,6 +490,7 @@ def generate_branch_name(diff, model_name=DEFAULT_MODEL_NAME, verbose=False, int
                 elif choice == 'r':
                     if verbose:
                         print("🔄 Regenerating branch name...")
+                    regenerations += 1
                     break # Break inner loop to regenerate
                 else:
                     print("Invalid choice. Please enter 'y', 'n', or 'r'.")
@@ -161,7 +502,7 @@ def generate_branch_name(diff, model_name=DEFAULT_MODEL_NAME, verbose=False, int
                 print(f"Prompt feedback: {response.prompt_feedback}")
             # Ask if user wants to retry in interactive mode
             if interactive:
-                retry_choice = input("Failed to generate. Retry? (y/n): ").lower().strip()
+                retry_choice = read_choice("Failed to generate. Retry? (y/n): ")
                 if retry_choice != 'y':
                     print("Aborted.")
                     sys.exit(1)
@@ -169,35 +510,46 @@ def generate_branch_name(diff, model_name=DEFAULT_MODEL_NAME, verbose=False, int
             else:
                 sys.exit(1) # Exit if not interactive
 
-def generate_commit_message(diff, model_name=DEFAULT_MODEL_NAME, lang='en', verbose=False, interactive=False):
+def generate_commit_message(diff, model_name=DEFAULT_MODEL_NAME, lang='en', verbose=False, interactive=False, use_cache=True):
     """Generates the commit message using the Gemini API, with optional interactive confirmation."""
-    if not GEMINI_API_KEY:
-        print("Error: Gemini API key (GEMINI_API_KEY) not found.")
-        print("Check your .env file or system environment variables.")
-        sys.exit(1)
+    cache_path = get_cache_path(diff, model_name, lang) if use_cache else None
+    cached_message = read_cached_message(cache_path) if cache_path else None
+    prompt = None
+    regenerations = 0
 
     while True: # Loop for regeneration
-        if verbose:
-            print(f"🤖 Generating commit message with model {model_name}...")
+        if cached_message:
+            # Reuse the message generated earlier for this exact diff (only once, 'r' always hits the API)
+            commit_message, cached_message = cached_message, None
+            if verbose:
+                print("💾 Using cached commit message for this diff.")
+        else:
+            commit_message = None
+            if verbose:
+                print(f"🤖 Generating commit message with model {model_name}...")
         try:
-            genai.configure(api_key=GEMINI_API_KEY)
-            model = genai.GenerativeModel(model_name)
-            language_map = {'pt': 'Portuguese', 'en': 'English'}
-            language_name = language_map.get(lang, 'English')
-            prompt = COMMIT_MESSAGE_PROMPT_TEMPLATE.format(diff=diff, language=language_name)
-
-            safety_settings = [
-                {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
-                {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
-                {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_NONE"},
-                {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"},
-            ]
-            response = model.generate_content(prompt, safety_settings=safety_settings)
-
-            commit_message = response.text.strip()
-            commit_message = commit_message.replace('```', '').replace('`', '').replace('"', '').replace("'", "")
-            if not commit_message:
-                 raise ValueError("The API returned an empty message.")
+            if commit_message is None:
+                if prompt is None: # Built on first use only, regenerating reuses it
+                    prompt_head = COMMIT_MESSAGE_PROMPT_HEADS.get(lang, COMMIT_MESSAGE_PROMPT_HEADS['en'])
+                    # Decoded only here (the diff is already shrunk), so at most DIFF_MAX_BYTES go through UTF-8 decoding
+                    prompt = [prompt_head, diff.decode('utf-8', 'replace'), COMMIT_MESSAGE_PROMPT_TAIL]
+                request_prompt = get_request_prompt(prompt, regenerations)
+                model = get_model(model_name)
+
+                def request():
+                    # Errors can also surface while reading the stream, so both are retried together
+                    response = model.generate_content(
+                        request_prompt,
+                        safety_settings=SAFETY_SETTINGS,
+                        generation_config=COMMIT_MESSAGE_GENERATION_CONFIG,
+                        stream=True
+                    )
+                    return read_first_line(response), response
+
+                commit_message, response = call_with_backoff(request, verbose=verbose)
+                commit_message = RESPONSE_CLEANUP_RE.sub('', commit_message).strip()
+                if not commit_message:
+                     raise ValueError("The API returned an empty message.")
 
             if verbose:
                 if interactive:
@@ -210,17 +562,21 @@ def generate_commit_message(diff, model_name=DEFAULT_MODEL_NAME, lang='en', verb
                 return commit_message # Return directly if not interactive
 
             # --- Interactive Confirmation ---
+            # Nothing is cached here: the caller caches the message once it is committed, and a rejected one is dropped
             print(f"\nSuggested commit message:\n---\n\033[1m{commit_message}\033[0m\n---") # Bold text
             while True:
-                choice = input("Accept this commit message? (y/n/r=regenerate): ").lower().strip()
+                choice = read_choice("Accept this commit message? (y/n/r=regenerate): ")
                 if choice == 'y':
                     return commit_message
                 elif choice == 'n':
+                    if cache_path:
+                        remove_cached_message(cache_path)
                     print("Aborted by user.")
                     sys.exit(0)
                 elif choice == 'r':
                     if verbose:
                         print("🔄 Regenerating commit message...")
+                    regenerations += 1
                     break # Break inner loop to regenerate
                 else:
                     print("Invalid choice. Please enter 'y', 'n', or 'r'.")
@@ -232,7 +588,7 @@ def generate_commit_message(diff, model_name=DEFAULT_MODEL_NAME, lang='en', verb
                 print(f"Prompt feedback: {response.prompt_feedback}")
             # Ask if user wants to retry in interactive mode
             if interactive:
-                retry_choice = input("Failed to generate. Retry? (y/n): ").lower().strip()
+                retry_choice = read_choice("Failed to generate. Retry? (y/n): ")
                 if retry_choice != 'y':
                     print("Aborted.")
                     sys.exit(1)
@@ -240,59 +596,203 @@ def generate_commit_message(diff, model_name=DEFAULT_MODEL_NAME, lang='en', verb
             else:
                 sys.exit(1) # Exit if not interactive
 
-def git_commit(message, verbose=False):
+def generate_branch_and_commit_message(diff, model_name=DEFAULT_MODEL_NAME, lang='en', verbose=False):
+    """Generates a branch name and a commit message with a single Gemini API call (non-interactive)."""
+    if verbose:
+        print(f"🤖 Generating branch name and commit message in a single request with model {model_name}...")
+    try:
+        model = get_model(model_name)
+        prompt_head = BRANCH_AND_COMMIT_PROMPT_HEAD.format(language=LANGUAGE_NAMES.get(lang, 'English'))
+        prompt = [prompt_head, diff.decode('utf-8', 'replace'), BRANCH_AND_COMMIT_PROMPT_TAIL]
+
+        response = call_with_backoff(lambda: model.generate_content(prompt, safety_settings=SAFETY_SETTINGS), verbose=verbose)
+
+        reply = BRANCH_AND_COMMIT_REPLY_RE.search(RESPONSE_CLEANUP_RE.sub('', response.text))
+        if not reply:
+            raise ValueError(f"The API returned an unexpected answer: {response.text.strip()!r}")
+        branch_name = sanitize_branch_name(reply.group('branch'))
+        commit_message = reply.group('commit')
+
+        if verbose:
+            print(f"✨ Branch name generated (sanitized): '{branch_name}' (Original: '{reply.group('branch')}')")
+            print("✨ Commit message generated:")
+            print(f"   '{commit_message}'")
+        return branch_name, commit_message
+
+    except Exception as e:
+        print(f"Error generating branch name and commit message with Gemini API: {e}")
+        if 'response' in locals() and hasattr(response, 'prompt_feedback'):
+            print(f"Prompt feedback: {response.prompt_feedback}")
+        sys.exit(1)
+
+def git_commit(message, verbose=False, cwd=None):
     """Commits with the provided message."""
     try:
         if verbose:
             print(f"🚀 Committing with message...")
-        run_git_command(['git', 'commit', '-m', message], verbose=verbose)
+        run_git_command(['git', 'commit', '-m', message], verbose=verbose, cwd=cwd)
         if verbose:
             print("🎉 Commit successful!")
     except Exception as e:
         print(f"Failed to commit changes.")
         sys.exit(1)
 
-def git_add_all(verbose=False):
-    """Adds all changes to the stage."""
+def exec_git_commit(message, verbose=False):
+    """Commits by replacing this process with 'git commit', so no extra process is forked and git's exit code is returned directly."""
+    if os.name != 'posix':
+        # There is no real exec on Windows (the shell would get control back before git finishes)
+        git_commit(message, verbose=verbose)
+        return
+    if verbose:
+        print(f"🚀 Committing with message...")
+    sys.stdout.flush() # Buffered output would be lost by the exec
+    saved_stdout = os.dup(sys.stdout.fileno())
+    if not verbose:
+        # Keep the output quiet as before: git's summary is only shown with --verbose, errors still go to stderr
+        with open(os.devnull, 'w') as devnull:
+            os.dup2(devnull.fileno(), sys.stdout.fileno())
+    try:
+        os.execvp('git', ['git', 'commit', '-m', message])
+    except OSError as e: # Only reached if git could not be started
+        os.dup2(saved_stdout, sys.stdout.fileno())
+        print(f"Failed to commit changes: {e}")
+        sys.exit(1)
+
+def git_add_command(add_all=False):
+    """Returns the staging command: 'git add -u' (tracked files only, as in the diff) or 'git add .' with add_all."""
+    return ['git', 'add', '.'] if add_all else ['git', 'add', '-u']
+
+def git_add_changes(verbose=False, add_all=False, cwd=None):
+    """Adds the changes to the stage."""
+    command = git_add_command(add_all)
     try:
         if verbose:
-            print("➕ Adding all changes to stage (git add .)...")
-        run_git_command(['git', 'add', '.'], verbose=verbose)
+            print(f"➕ Adding changes to stage ({' '.join(command)})...")
+        run_git_command(command, verbose=verbose, cwd=cwd)
     except Exception as e:
-        print(f"❌ Failed to stage changes (git add .).")
+        print(f"❌ Failed to stage changes ({' '.join(command)}).")
         sys.exit(1)
 
-def git_create_and_checkout_branch(branch_name, verbose=False):
-    """Creates and checks out a new Git branch."""
+def backup_index(verbose=False):
+    """Copies the Git index next to itself and returns (index path, backup path), the backup being None if there is no index."""
+    index_path = run_git_command(['git', 'rev-parse', '--git-path', 'index'], verbose=verbose)
+    fd, backup_path = tempfile.mkstemp(prefix='index.aicommit-', dir=os.path.dirname(index_path) or '.')
+    os.close(fd)
+    try:
+        shutil.copyfile(index_path, backup_path)
+    except OSError:
+        os.remove(backup_path)
+        backup_path = None
+    return index_path, backup_path
+
+def start_git_add_changes(verbose=False, add_all=False):
+    """Starts adding the changes to the stage in the background and returns (process, index path, index backup path)."""
+    command = git_add_command(add_all)
+    # Copied first, so undo_git_add_changes() can put the index back exactly (e.g. keeping 'git add -N' entries)
+    index_path, backup_path = backup_index(verbose=verbose)
     try:
         if verbose:
-            print(f"🌿 Creating and checking out new branch '{branch_name}'...") # Added branch name for clarity
-        run_git_command(['git', 'checkout', '-b', branch_name], verbose=verbose)
+            print(f"➕ Adding changes to stage in the background ({' '.join(command)})...")
+        return subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE), index_path, backup_path
+    except Exception as e:
+        print(f"❌ Failed to stage changes ({' '.join(command)}): {e}")
+        sys.exit(1)
+
+def wait_git_add_changes(background_add, verbose=False):
+    """Waits for a 'git add' started by start_git_add_changes and exits if it failed."""
+    process, _, backup_path = background_add
+    _, stderr = process.communicate()
+    if backup_path:
+        os.remove(backup_path)
+    if process.returncode != 0:
+        if verbose:
+            print(f"Error: {stderr.decode('utf-8', 'replace').strip()}")
+        print(f"❌ Failed to stage changes ({' '.join(process.args)}).")
+        sys.exit(1)
+
+def undo_git_add_changes(background_add, verbose=False):
+    """Waits for a 'git add' started by start_git_add_changes and puts the index back as it was before."""
+    process, index_path, backup_path = background_add
+    process.communicate()
+    if verbose:
+        print("↩️ Unstaging the changes added in the background...")
+    if backup_path:
+        os.replace(backup_path, index_path) # Same directory, so the index is swapped atomically
+    else:
+        subprocess.run(['git', 'reset', '-q'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def git_create_and_checkout_branch(branch_name, verbose=False):
+    """Creates and checks out a new Git branch, or checks it out if it already exists."""
+    # A single ref lookup picks the right 'git switch' up front (no second attempt, no parsing of localized stderr)
+    exists = subprocess.run(['git', 'show-ref', '--verify', '--quiet', f'refs/heads/{branch_name}'],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode == 0
+    if exists:
+        if verbose:
+            print(f"⚠️ Branch '{branch_name}' already exists. Checking it out...")
+        run_git_command(['git', 'switch', branch_name], verbose=verbose)
+        if verbose:
+            print(f"✅ Switched to existing branch '{branch_name}'.")
+    else:
+        if verbose:
+            print(f"🌿 Creating and checking out new branch '{branch_name}'...")
+        run_git_command(['git', 'switch', '-c', branch_name], verbose=verbose)
         if verbose:
             print(f"✅ Switched to new branch '{branch_name}'.")
-    except subprocess.CalledProcessError as e:
-        if "already exists" in e.stderr:
-             if verbose:
-                 print(f"⚠️ Branch '{branch_name}' already exists. Attempting to checkout...")
-             try:
-                 run_git_command(['git', 'checkout', branch_name], verbose=verbose)
-                 if verbose:
-                     print(f"✅ Switched to existing branch '{branch_name}'.")
-             except Exception as checkout_e:
-                 print(f"❌ Failed to checkout existing branch '{branch_name}'.")
-                 sys.exit(1)
-        else:
-            print(f"❌ Failed to create or checkout branch '{branch_name}'.")
-            sys.exit(1)
-    except Exception as e:
-        print(f"❌ An unexpected error occurred during branch creation/checkout: {e}")
+
+def commit_repository(repo, args):
+    """Generates a message for and commits the changes of one repository (--batch). Returns the message, or None."""
+    if not os.path.isdir(repo):
+        print(f"Error: '{repo}' is not a directory.")
+        sys.exit(1)
+    diff, is_staged_diff = get_diff(verbose=args.verbose, cwd=repo)
+    if diff is None:
+        return None
+    commit_message = generate_commit_message(diff, model_name=args.model, lang=args.lang, verbose=args.verbose, use_cache=not args.no_cache)
+    if not is_staged_diff:
+        git_add_changes(verbose=args.verbose, add_all=args.add_all, cwd=repo)
+    git_commit(commit_message, verbose=args.verbose, cwd=repo)
+    if not args.no_cache:
+        write_cached_message(get_cache_path(diff, args.model, args.lang), commit_message)
+    return commit_message
+
+def run_batch(batch_file, args):
+    """Commits every repository listed in batch_file in one process, sharing the same model client."""
+    try:
+        with open(batch_file, encoding='utf-8') as f:
+            repos = [line.strip() for line in f if line.strip() and not line.lstrip().startswith('#')]
+    except OSError as e:
+        print(f"Error: Could not read batch file '{batch_file}': {e}")
         sys.exit(1)
 
+    failed = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=BATCH_MAX_WORKERS) as executor:
+        futures = [executor.submit(commit_repository, repo, args) for repo in repos]
+        for repo, future in zip(repos, futures):
+            try:
+                commit_message = future.result()
+            except SystemExit: # The error was already reported by the failing helper
+                failed += 1
+                print(f"❌ {repo}: failed.")
+                continue
+            if commit_message is None:
+                print(f"✅ {repo}: no changes (staged or unstaged) detected to process.")
+            else:
+                print(f"🎉 {repo}: {commit_message}")
+    sys.exit(1 if failed else 0)
+
 # --- Main Execution ---
 def main():
+    # Fast path: when no option is given that needs parsing, exit on a clean tree before any other work
+    change_state = None
+    if sys.argv[1:] in ([], ['-v'], ['--verbose']):
+        change_state = probe_change_state()
+        if change_state == (False, False):
+            print("✅ No changes (staged or unstaged) detected to process.")
+            sys.exit(0)
+
     parser = argparse.ArgumentParser(description='Generate commit messages and optionally branch names using AI.')
     parser.add_argument('-v', '--verbose', action='store_true', help='Show detailed messages during execution.')
-    parser.add_argument('-l', '--lang', choices=['pt', 'en'], default='en', help='Commit message language (pt or en). Default: en.')
+    parser.add_argument('-l', '--lang', choices=list(LANGUAGE_NAMES), default='en', help='Commit message language (pt or en). Default: en.')
     parser.add_argument(
         '-m', 
         '--model', 
@@ -304,53 +804,133 @@ def main():
         '-b',
         '--new-branch',
         action='store_true',
-        help='Generate a branch name using AI, create and checkout the new branch before committing.'
+        help='Create and checkout a new branch before committing, named after the commit message (or by AI with --no-derive-branch-from-message).'
     )
     parser.add_argument(
         '-i',
         '--interactive',
         action='store_true',
-        help='Prompt for confirmation before using the generated branch name or commit message.'
+        help='Prompt for confirmation before using the generated commit message (and the AI branch name with --no-derive-branch-from-message).'
+    )
+    parser.add_argument(
+        '--single-request',
+        action='store_true',
+        help='With -b and without -i, generate the branch name and commit message in a single API call, sending the diff only once (implies --no-derive-branch-from-message).'
+    )
+    parser.add_argument(
+        '--derive-branch-from-message',
+        dest='derive_branch',
+        action='store_true',
+        default=True,
+        help="With -b, derive the branch name from the commit message (e.g. 'feat: add X' -> 'feat/add-x') without an extra API call. Default."
+    )
+    parser.add_argument(
+        '--no-derive-branch-from-message',
+        dest='derive_branch',
+        action='store_false',
+        help='With -b, generate the branch name with its own AI request instead.'
+    )
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='Always call the API instead of reusing a cached commit message for the same diff.'
+    )
+    parser.add_argument(
+        '--add-all',
+        action='store_true',
+        help="When committing unstaged changes, stage everything including untracked files ('git add .') instead of only tracked files ('git add -u')."
+    )
+    parser.add_argument(
+        '--batch',
+        metavar='FILE',
+        help='Commit the changes of every repository listed in FILE (one path per line) in a single run.'
     )
     args = parser.parse_args()
+    if args.batch and (args.new_branch or args.interactive):
+        parser.error('--batch cannot be combined with --new-branch or --interactive.')
+    if args.single_request and (not args.new_branch or args.interactive):
+        parser.error('--single-request requires --new-branch and cannot be combined with --interactive.')
+    if args.single_request:
+        args.derive_branch = False # The single request already returns a branch name
+
+    # Checked once here, before any Git or API work, for every mode below
+    if not load_api_key():
+        print("Error: Gemini API key (GEMINI_API_KEY) not found.")
+        print("Check your .env file or system environment variables.")
+        sys.exit(1)
 
-    diff_to_process = None
-    is_staged_diff = False
+    # Set up the Gemini client while git computes the diff
+    prefetch_model(args.model)
 
-    staged_diff = get_staged_diff(verbose=args.verbose)
-    if staged_diff:
-        diff_to_process = staged_diff
-        is_staged_diff = True
-        if args.verbose:
-            print("ℹ️ Using staged changes for AI generation.")
-    else:
-        unstaged_diff = get_unstaged_diff(verbose=args.verbose)
-        if unstaged_diff:
-            diff_to_process = unstaged_diff
-            is_staged_diff = False
-            if args.verbose:
-                print("ℹ️ No staged changes found. Using unstaged changes for AI generation.")
-        else:
-            print("✅ No changes (staged or unstaged) detected to process.")
-            sys.exit(0)
+    if args.batch:
+        run_batch(args.batch, args)
+
+    # Reuse the fast path probe, if any, instead of running 'git status' again
+    diff_to_process, is_staged_diff = get_diff(verbose=args.verbose, change_state=change_state)
+    if diff_to_process is None:
+        print("✅ No changes (staged or unstaged) detected to process.")
+        sys.exit(0)
 
-    # --- Branch Creation (if requested) ---
-    if args.new_branch:
+    commit_message = None
+    # By default the branch name is derived from the commit message, without an API call of its own
+    derive_branch = args.new_branch and args.derive_branch
+
+    # --- Branch Creation (if requested, with an AI generated name) ---
+    if args.single_request: # Only accepted with -b and without -i
+        branch_name, commit_message = generate_branch_and_commit_message(diff_to_process, model_name=args.model, lang=args.lang, verbose=args.verbose)
+        git_create_and_checkout_branch(branch_name, verbose=args.verbose)
+    elif args.new_branch and not derive_branch and not args.interactive:
+        # Both names only depend on the diff, so the two API calls run concurrently.
+        # (Interactive mode stays sequential: each suggestion is confirmed in turn.)
+        if args.verbose:
+            print("📝 Generating branch name and commit message...")
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            branch_future = executor.submit(generate_branch_name, diff_to_process, model_name=args.model, verbose=args.verbose)
+            message_future = executor.submit(generate_commit_message, diff_to_process, model_name=args.model, lang=args.lang, verbose=args.verbose, use_cache=not args.no_cache)
+            branch_name, commit_message = branch_future.result(), message_future.result()
+        git_create_and_checkout_branch(branch_name, verbose=args.verbose)
+    elif args.new_branch and not derive_branch:
         branch_name = generate_branch_name(diff_to_process, model_name=args.model, verbose=args.verbose, interactive=args.interactive)
         git_create_and_checkout_branch(branch_name, verbose=args.verbose)
 
-    # --- Commit Message Generation ---
-    if args.verbose:
-        print("📝 Generating commit message...")
-    commit_message = generate_commit_message(diff_to_process, model_name=args.model, lang=args.lang, verbose=args.verbose, interactive=args.interactive)
+    background_add = None
+    if commit_message is None:
+        # --- Staging (in the background, while the AI generates the message) ---
+        # The staged content does not depend on the message, so 'git add' overlaps with the API call.
+        # In interactive mode the user may still abort, so staging waits for the confirmation.
+        # With a derived branch, staging waits for the branch switch, so a failed switch leaves the index untouched.
+        if not is_staged_diff and not args.interactive and not derive_branch:
+            background_add = start_git_add_changes(verbose=args.verbose, add_all=args.add_all)
+
+        # --- Commit Message Generation ---
+        if args.verbose:
+            print("📝 Generating commit message...")
+        try:
+            commit_message = generate_commit_message(diff_to_process, model_name=args.model, lang=args.lang, verbose=args.verbose, interactive=args.interactive, use_cache=not args.no_cache)
+        except (SystemExit, KeyboardInterrupt):
+            # A failed run must not leave the worktree staged
+            if background_add:
+                undo_git_add_changes(background_add, verbose=args.verbose)
+            raise
+
+    # --- Branch Creation (if requested, named after the commit message) ---
+    # Done before staging: if the switch fails, none of the user's changes have been staged
+    if derive_branch:
+        git_create_and_checkout_branch(branch_name_from_message(commit_message, verbose=args.verbose), verbose=args.verbose)
 
     # --- Staging and Committing ---
-    if not is_staged_diff:
+    if background_add:
+        wait_git_add_changes(background_add, verbose=args.verbose)
+    elif not is_staged_diff:
         # If we used unstaged diff, we always need to stage changes before commit
-        git_add_all(verbose=args.verbose)
+        git_add_changes(verbose=args.verbose, add_all=args.add_all)
+
+    # Cached only now that the branch switch and staging succeeded, so a failing message is not reused on the next run
+    if not args.no_cache:
+        write_cached_message(get_cache_path(diff_to_process, args.model, args.lang), commit_message)
 
-    # Commit the changes (either staged originally, or newly staged)
-    git_commit(commit_message, verbose=args.verbose)
+    # Commit the changes (either staged originally, or newly staged); this is the last step, so git replaces this process
+    exec_git_commit(commit_message, verbose=args.verbose)
 
 
 if __name__ == "__main__":
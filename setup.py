@@ -1,8 +1,12 @@
+from pathlib import Path
 from setuptools import setup
 
 with open('requirements.txt') as f:
     required = f.read().splitlines()
 
+readme = Path('README.md')
+long_description = readme.read_text(encoding='utf-8') if readme.exists() else ''
+
 setup(
     name='aicommit-cli',
     version='0.1.0',
@@ -16,7 +20,7 @@ setup(
     author='João Pedro Leopoldino',
     author_email='leopoldinodev@gmail.com',
     description='A CLI tool to generate commit messages using AI',
-    long_description=open('README.md').read() if open('README.md') else '',
+    long_description=long_description,
     long_description_content_type='text/markdown',
     url='https://github.com/JPLeopoldino/aicommit-cli',
     classifiers=[